@@ -0,0 +1,51 @@
+"""Checks the precomputed HMAC signing in `xeggex.Auth` against the stdlib `hmac` module."""
+
+import hashlib
+import hmac
+import unittest
+
+from xeggex import Auth
+
+ACCESS_KEY = 'access_key_0123456789'
+# A short key, one exactly a SHA-256 block long, and one longer that gets hashed first.
+SECRET_KEYS = ('secret', 'k'*64, 'long secret key '*5)
+
+
+def reference(secret_key: str, payload: bytes) -> str:
+    return hmac.new(secret_key.encode(), payload, hashlib.sha256).hexdigest()
+
+
+class AuthSignatureTest(unittest.TestCase):
+
+    def test_sign_bytes(self):
+        for secret_key in SECRET_KEYS:
+            auth = Auth(ACCESS_KEY, secret_key)
+            for payload in (b'', b'nonce', b'x'*200):
+                with self.subTest(key_length=len(secret_key), payload_length=len(payload)):
+                    self.assertEqual(auth.sign_bytes(payload), reference(secret_key, payload))
+                    self.assertEqual(auth.sign(payload.decode()), reference(secret_key, payload))
+
+    def test_headers_bytes(self):
+        url = b'https://xeggex.com/api/v2/balances'
+        for secret_key in SECRET_KEYS:
+            auth = Auth(ACCESS_KEY, secret_key)
+            # The same payload again goes through the memoized inner state.
+            for _ in range(3):
+                with self.subTest(key_length=len(secret_key)):
+                    headers = auth.headers_bytes(url)
+                    nonce = headers['X-API-NONCE']
+                    expected = reference(secret_key, ACCESS_KEY.encode()+url+nonce.encode())
+                    self.assertEqual(headers['X-API-SIGN'], expected)
+                    self.assertEqual(headers['X-API-KEY'], ACCESS_KEY)
+
+    def test_headers_memoized_state_isnt_mutated(self):
+        auth = Auth(ACCESS_KEY, SECRET_KEYS[0])
+        first, second = auth.headers_bytes(b'/a'), auth.headers_bytes(b'/a')
+        self.assertNotEqual(first['X-API-NONCE'], second['X-API-NONCE'])
+        for headers in (first, second):
+            payload = ACCESS_KEY.encode()+b'/a'+headers['X-API-NONCE'].encode()
+            self.assertEqual(headers['X-API-SIGN'], reference(SECRET_KEYS[0], payload))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,79 +1,181 @@
 """The module for accessing XeggeX API written in asynchronous python"""
 
 import json
-import hashlib, hmac
-from urllib.parse import urlencode
-import string
-import random
-from time import time
+import hashlib
+import platform
+from urllib.parse import urlencode, quote_plus
+import secrets
+import sys
+from time import time, monotonic
 import asyncio
+import inspect
 import aiohttp
 from aiohttp import ClientWebSocketResponse
-from functools import wraps
+from functools import wraps, lru_cache
 from itertools import count
-from decimal import Decimal
 from datetime import datetime
-from typing import Optional, List, Dict, Any, Union, Callable, Generator
-from collections import defaultdict
+from typing import Optional, List, Dict, Tuple, FrozenSet, Iterable, Any, Union, Callable, Generator
+from collections import defaultdict, deque
 from asyncio import Queue
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    def json_dumps(obj: Any) -> str:
+        """Compact JSON serialization, uses orjson when it's installed."""
+        return orjson.dumps(obj).decode()
+    json_loads = orjson.loads
+else:
+    def json_dumps(obj: Any) -> str:
+        """Compact JSON serialization, uses orjson when it's installed."""
+        return json.dumps(obj, separators=(',',':'))
+    json_loads = json.loads
+
 subscriptions: Dict[str, Dict[str, Any]] = {
     "ticker": {
         "message": lambda symbol: {'method': 'subscribeTicker', 'params': {'symbol': symbol}},
-        "methods": ['ticker']
+        "methods": frozenset({'ticker'})
     },
     'orderbook': {
         'message': lambda symbol, limit: {
             'method': 'subscribeOrderbook', 'params': pop_none({'symbol': symbol,'limit': limit})},
-        'methods': ['snapshotOrderbook', 'updateOrderbook']
+        'methods': frozenset({'snapshotOrderbook', 'updateOrderbook'})
     },
     'trades': {
         'message': lambda symbol: {'method': 'subscribeTrades', 'params': {'symbol': symbol}},
-        'methods': ['snapshotTrades', 'updateTrades']
+        'methods': frozenset({'snapshotTrades', 'updateTrades'})
     },
     'candles': {
         'message': lambda symbol, period, limit:  {
             'method': 'subscribeCandles',
             'params': pop_none({'symbol':symbol, 'period': period, 'limit': limit})},
-        'methods': ['snapshotCandles', 'updateCandles']
+        'methods': frozenset({'snapshotCandles', 'updateCandles'})
     },
     'reports': {
         'message': lambda :{'method': 'subscribeReports', 'params': {}},
-        'methods':  ['activeOrders', 'report']
+        'methods':  frozenset({'activeOrders', 'report'})
     }
 }
 
+def check_sha_acceleration() -> Optional[str]:
+    """Checks if request signing can use OpenSSL's hardware accelerated SHA-256, nothing runs it on import.
+
+    Only OpenSSL backed hashlib dispatches to the SHA-NI instructions, the CPU flag is read from `/proc/cpuinfo` on x86 Linux.
+    Returns the reason signing isn't accelerated, or None if it is or it can't be determined.
+    """
+    if hashlib.sha256.__name__ != 'openssl_sha256':
+        return "hashlib isn't backed by OpenSSL, request signing uses the slower builtin SHA-256."
+    if platform.machine().lower() not in ('x86_64', 'amd64'):
+        return None
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    if 'sha_ni' not in line.split():
+                        return "CPU doesn't report SHA-NI support, request signing uses the scalar SHA-256."
+                    return None
+    except OSError:
+        pass
+    return None
+
+# The stream each subscription notification method is dispatched to.
+METHOD_TO_STREAM: Dict[str, str] = {
+    method: stream for stream, values in subscriptions.items() for method in values['methods']
+}
+
+# Aborting SSL transports that never finish closing is only needed before https://github.com/python/cpython/pull/118960,
+# which landed in Python 3.12.7 and 3.13.1, aiohttp ignores the option with a DeprecationWarning on the fixed versions.
+NEEDS_CLEANUP_CLOSED = sys.version_info < (3, 12, 7) or (3, 13, 0) <= sys.version_info < (3, 13, 1)
+
+WS_TEXT = aiohttp.WSMsgType.TEXT
+WS_BINARY = aiohttp.WSMsgType.BINARY
+WS_ERROR = aiohttp.WSMsgType.ERROR
+WS_CLOSED = aiohttp.WSMsgType.CLOSED
+WS_CLOSE = aiohttp.WSMsgType.CLOSE
+
 class Auth():
     """Authentication class that produces headers for api and login message for websocket."""
     def __init__(self, access_key: str, secret_key: str) -> None:
         super().__init__()
         self.secret_key = secret_key
         self.access_key = access_key
+        self._secret_bytes = secret_key.encode('ascii')
+        self._access_bytes = access_key.encode('ascii')
+        # HMAC-SHA256 with precomputed keys (RFC 2104): the inner and outer hash states after the padded key
+        # are computed once and copied for every signature, skipping the Python level hmac.HMAC bookkeeping.
+        key = self._secret_bytes
+        if len(key) > 64:
+            key = hashlib.sha256(key).digest()
+        key = key.ljust(64, b'\0')
+        self._inner = hashlib.sha256(bytes(b ^ 0x36 for b in key))
+        self._outer = hashlib.sha256(bytes(b ^ 0x5c for b in key))
+        # REST signatures always start with the access key, and polling repeats the same payloads,
+        # so the inner state after hashing the access key and the payload is memoized and only the nonce is hashed per call.
+        self._access_key_state = self._inner.copy()
+        self._access_key_state.update(self._access_bytes)
+        self._payload_state = lru_cache(maxsize=128)(self._hash_payload)
+        # Strictly increasing nonces that follow the clock, two requests within the same millisecond can't collide.
+        self._nonce = int(time()*1000)
+        # The login message up to the nonce, neither the url safe nonce nor the hex signature need escaping.
+        self._login_prefix = '{"method":"login","params":{"algo":"HS256","pKey":'+json_dumps(access_key)+',"nonce":"'
+        self._headers_template = {
+            "X-API-KEY": access_key,
+            "Content-Type": "application/json",
+        }
+
+    def _finish(self, inner) -> str:
+        """Completes the HMAC from an updated inner hash state."""
+        outer = self._outer.copy()
+        outer.update(inner.digest())
+        return outer.hexdigest()
+
+    def sign_bytes(self, payload: bytes) -> str:
+        """Produces signature for an already encoded payload."""
+        inner = self._inner.copy()
+        inner.update(payload)
+        return self._finish(inner)
 
     def sign(self, payload: str) -> str:
         """Produces signature for an arbitrary string."""
-        signature = hmac.new(
-            self.secret_key.encode(),
-            payload.encode(),
-            hashlib.sha256
-        ).hexdigest()
-        return signature
+        return self.sign_bytes(payload.encode())
+
+    def _hash_payload(self, payload: bytes):
+        """Inner hash state after the access key and the payload, must be copied before updating."""
+        h = self._access_key_state.copy()
+        h.update(payload)
+        return h
 
     def headers(self, payload: str) -> dict:
         """Creates auth headers for rest API."""
-        nonce = str(int(time()*1000))
-        signature = self.sign(self.access_key+payload+nonce)
-        headers =  {
-            "X-API-KEY": self.access_key,
-            "X-API-NONCE": nonce,
-            "X-API-SIGN": signature,
-            "Content-Type": "application/json",
-        }
+        return self.headers_bytes(payload.encode())
+
+    def headers_bytes(self, payload: bytes) -> dict:
+        """Creates auth headers for rest API from an already encoded payload."""
+        self._nonce = max(self._nonce+1, int(time()*1000))
+        nonce = str(self._nonce)
+        inner = self._payload_state(payload).copy()
+        inner.update(nonce.encode())
+        signature = self._finish(inner)
+        headers = self._headers_template.copy()
+        headers["X-API-NONCE"] = nonce
+        headers["X-API-SIGN"] = signature
         return headers
 
+    def headers_many(self, payloads: List[bytes]) -> List[dict]:
+        """Creates auth headers for several already encoded payloads, nonces increase in the order of the payloads."""
+        return [self.headers_bytes(payload) for payload in payloads]
+
+    def ws_auth_frame(self, message_id: int) -> str:
+        """Creates a serialized login message for websocket with the given request id."""
+        nonce = secrets.token_urlsafe(15)
+        return self._login_prefix+nonce+'","signature":"'+self.sign(nonce)+'"},"id":'+str(message_id)+'}'
+
     def ws_auth_message(self) -> dict:
         """Creates a login string for websocket."""
-        nonce = ''.join(random.choice(string.ascii_letters+string.digits) for i in range(20))
+        nonce = secrets.token_urlsafe(15)
         return {
             'method':'login',
             'params':{
@@ -84,24 +186,76 @@ class Auth():
             }
         }
 
+AUTH_NOT_FOUND = "Auth not found. You can't use Account endpoints without specifying API keys. Specify \"access_key\" and \"secret_key\" in \"xeggex_settings.json\" file."
+
 def private(func: Callable) -> Callable:
     """Decorator for declaring functions that require API keys.
 
     A decorated function will throw an assertion error if API keys aren't placed in `xeggex_settings.json` file.
+    The function is only marked, the client replaces it with `auth_not_found` while its `auth` is None,
+    so calls with keys don't go through any wrapper. Setting `client.auth = Auth(access_key, secret_key)` enables them.
+    """
+    func._private = True
+    return func
+
+def auth_not_found(*args, **kwargs):
+    """Stands in for private methods of a client without API keys."""
+    raise AssertionError(AUTH_NOT_FOUND)
+
+def cached(func: Callable) -> Callable:
+    """Decorator for public endpoints whose results may be reused when the client opts in.
+
+    The result is reused for `cache_ttl` seconds set in the client constructor, caching is off by default, concurrent calls with the same arguments
+    share a single request. Failed requests aren't cached. The cached object is shared, don't modify it in place.
+    Expired entries are dropped whenever a new one is stored, and at most `cache_max_size` entries are kept.
     """
+    # Keyword arguments are mapped to positions once here, so `f('A_B')` and `f(symbol='A_B')` share an entry.
+    names = tuple(inspect.signature(func).parameters)[1:]
+
     @wraps(func)
-    async def wrap(*args, **kwargs):
-        assert args[0].auth is not None, "Auth not found. You can't use Account endpoints without specifying API keys. Specify \"access_key\" and \"secret_key\" in \"xeggex_settings.json\" file."
-        return await func(*args, **kwargs)
+    async def wrap(self, *args, **kwargs):
+        if self.cache_ttl <= 0 or self.cache_max_size <= 0:
+            return await func(self, *args, **kwargs)
+        if kwargs:
+            rest = names[len(args):]
+            if len(kwargs) != len(rest) or not all(name in kwargs for name in rest):
+                # Unknown or missing arguments, let the call raise the usual TypeError.
+                return await func(self, *args, **kwargs)
+            args += tuple(kwargs[name] for name in rest)
+        key = (func.__name__, args)
+        now = monotonic()
+        cache = self._cache
+        entry = cache.get(key)
+        if entry is None or entry[0] < now:
+            for k in [k for k, (deadline, task) in cache.items() if deadline < now]:
+                del cache[k]
+            while len(cache) >= self.cache_max_size:
+                del cache[next(iter(cache))]
+            task = asyncio.ensure_future(func(self, *args))
+            entry = cache[key] = (now + self.cache_ttl, task)
+            def forget_failed(t):
+                if (t.cancelled() or t.exception() is not None) and cache.get(key) is entry:
+                    cache.pop(key)
+            task.add_done_callback(forget_failed)
+        return await asyncio.shield(entry[1])
     return wrap
 
+def query_string(params: Iterable[Tuple[str, Any]]) -> str:
+    """A helper function that url encodes (key, value) pairs into a query string, skipping the ones with a None value"""
+    return '&'.join(f'{key}={quote_plus(str(value))}' for key, value in params if value is not None)
+
 def pop_none(params: Dict) -> Dict:
-    """A helper function that removes parameters with a None value"""
-    par = params.copy().items()
-    for key, value in par:
-        if not value:
-            params.pop(key)
-    return params
+    """A helper function that returns a copy of the parameters without the ones with a None value"""
+    return {key: value for key, value in params.items() if value is not None}
+
+def nonzero(amount: str) -> bool:
+    """Checks if a fixed point decimal string like \"0.00000000\" is nonzero without parsing it."""
+    return bool(amount.strip('0.-'))
+
+@lru_cache(maxsize=256)
+def subscription_frame(stream: str, **params) -> str:
+    """Serialized subscription message for a stream, memoized since the same subscriptions are repeated on every reconnect."""
+    return json_dumps(subscriptions[stream]['message'](**params))
 
 class WSException(Exception):
     pass
@@ -109,27 +263,90 @@ class WSException(Exception):
 class WSConnectionClosed(WSException):
     pass
 
+class StreamBuffer():
+    """A bounded buffer of received websocket messages.
+
+    When the consumer falls behind, the oldest messages are dropped instead of letting the buffer grow without limit.
+    """
+    def __init__(self, maxlen: int) -> None:
+        self.messages: deque = deque(maxlen=maxlen)
+        self.event = asyncio.Event()
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def put_nowait(self, message: Any) -> None:
+        if len(self.messages) == self.messages.maxlen:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                print(f"Stream consumer is too slow, dropped {self.dropped} messages so far.")
+        self.messages.append(message)
+        self.event.set()
+
+    def popleft(self) -> Any:
+        return self.messages.popleft()
+
+    async def get(self) -> Any:
+        while not self.messages:
+            self.event.clear()
+            await self.event.wait()
+        return self.messages.popleft()
+
 class WSListenerContext():
-    """Websocket listener context class, wraps the asyncio websocket context by adding a listener and removes it afterwards."""
-    def __init__(self, ws, listener_function: Callable) -> None:
+    """Websocket listener context class, wraps the asyncio websocket context by adding a listener and a writer and removes them afterwards."""
+    def __init__(self, ws, listener_function: Callable, writer_function: Callable) -> None:
         self.ws = ws
         self.listener = listener_function
+        self.writer = writer_function
         self.task = None
+        self.writer_task = None
 
     async def __aenter__(self):
         ws = await self.ws.__aenter__()
+        ws.send_queue = Queue()
         self.task = asyncio.create_task(self.listener(ws))
+        self.writer_task = asyncio.create_task(self.writer(ws))
         ws.listener_task = self.task
+        ws.writer_task = self.writer_task
         return ws
 
     async def __aexit__(self, *exc) -> bool:
         self.task.cancel()
+        self.writer_task.cancel()
         await self.ws.__aexit__(*exc)
         return False
 
 class XeggeXClient():
     """The class that for accessing XeggeX exchange API."""
-    def __init__(self, settings_file: str = 'xeggex_settings.json') -> None:
+    # Serialized parameterless requests, missing only the id value and the closing brace.
+    _STATIC_FRAMES: Dict[str, str] = {
+        method: json_dumps({'method': method, 'params': {}})[:-1]+',"id":'
+        for method in ('getTradingBalance', 'getAssets', 'getMarkets', 'unsubscribeReports')
+    }
+
+    # Query parameter names of the paginated trade endpoints, in the order of their arguments.
+    _PAGE_KEYS = ('limit', 'skip', 'symbol')
+    _SINCE_KEYS = ('since', 'limit', 'skip', 'symbol')
+
+    def __init__(
+        self,
+        settings_file: str = 'xeggex_settings.json',
+        cache_ttl: float = 0,
+        cache_max_size: int = 256,
+        warm_up: bool = True,
+        stream_buffer_size: int = 1024
+    ) -> None:
+        """
+        Args:
+            settings_file: Path to the json file with API keys.
+            cache_ttl: Seconds for which the results of the `@cached` public endpoints are reused, 0 (the default)
+                disables caching. Market and pool objects carry live prices, a cached one can be that many seconds old
+                and is the same object for every caller.
+            cache_max_size: The maximum number of cached results, the oldest are dropped beyond that, 0 disables caching.
+            warm_up: Open the REST connection right away, so the first request doesn't pay for the TLS handshake.
+            stream_buffer_size: The number of unconsumed messages kept per stream, the oldest are dropped beyond that.
+        """
         self.auth: Optional[Auth]
         try:
             with open(settings_file) as f:
@@ -139,39 +356,138 @@ class XeggeXClient():
             self.auth = None
         self.endpoint = "https://xeggex.com/api/v2"
         self.ws_endpoint = 'wss://api.xeggex.com'
-        self.ws_responses = defaultdict(Queue)
-        self.session = aiohttp.ClientSession()
-        self.sending_event = asyncio.Event()
-        self.ws_lock = asyncio.Lock()
+        self.ws_responses: Dict[str, StreamBuffer] = defaultdict(lambda: StreamBuffer(stream_buffer_size))
+        self._pending: Dict[int, asyncio.Future] = {}
+        self.cache_ttl = cache_ttl
+        self.cache_max_size = cache_max_size
+        self._cache: Dict[tuple, tuple] = {}
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=0,
+                limit_per_host=64,
+                ttl_dns_cache=300,
+                keepalive_timeout=75,
+                enable_cleanup_closed=NEEDS_CLEANUP_CLOSED,
+                force_close=False
+            ),
+            json_serialize=json_dumps
+        )
+        # Applied to REST requests only, a session wide total timeout would also cover websocket handshakes.
+        self.rest_timeout = aiohttp.ClientTimeout(total=30)
         self.id = count(start=1)
+        self._warm_up_task: Optional[asyncio.Task] = None
+        if warm_up:
+            self._warm_up_task = asyncio.get_running_loop().create_task(self.warm_up())
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        """Shadows the private methods with `auth_not_found` while `auth` is None, and restores them once it's set."""
+        super().__setattr__(name, value)
+        if name == 'auth':
+            for method in dir(type(self)):
+                if getattr(getattr(type(self), method), '_private', False):
+                    if value is None:
+                        self.__dict__[method] = auth_not_found
+                    else:
+                        self.__dict__.pop(method, None)
+
+    async def warm_up(self) -> None:
+        """Opens a keep-alive connection to the REST endpoint, the response is discarded."""
+        try:
+            async with self.session.head(self.endpoint+'/asset/getlist', timeout=self.rest_timeout):
+                pass
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as ex:
+            print(f"REST connection warm up failed: {ex}")
+
+    async def __aenter__(self) -> 'XeggeXClient':
+        return self
+
+    async def __aexit__(self, *exc) -> bool:
+        await self.close()
+        return False
 
     async def close(self) -> None:
+        """Closes the REST session, use it or `async with XeggeXClient() as x:` when you're done with the client."""
+        if self._warm_up_task is not None:
+            self._warm_up_task.cancel()
         await self.session.close()
 
-    async def get(self, path: str, params: dict = {}):
-        """The basic GET query, inserts authorization header."""
-        params_str = '?'+urlencode(params) if params else ''
-        async with self.session.get(
-            self.endpoint+path+params_str,
-            headers = self.auth.headers(self.endpoint+path+params_str) if self.auth else {}
-        ) as resp:
+    def _get_url(self, path: str, params: Union[Dict, str] = '') -> str:
+        """Builds the url of a GET request, it's also the signed payload."""
+        query = urlencode(params) if isinstance(params, dict) else params
+        return ''.join((self.endpoint, path, '?', query)) if query else self.endpoint+path
+
+    def _post_request(self, path: str, data: dict) -> Tuple[str, str]:
+        """Builds the url and the body of a POST request, the signed payload is the two joined."""
+        return self.endpoint+path, json_dumps(data)
+
+    @private
+    def batch_get_headers(self, requests: List[Tuple[str, Union[Dict, str]]]) -> List[dict]:
+        """Creates auth headers for many GET requests at once.
+
+        Pass each of the headers to `get` with the same path and params it was created for. Nonces are assigned
+        when the batch is signed, not when a request is sent, so the requests must be sent sequentially, each awaited
+        before the next one, in the given order and before signing any other request. Don't fan them out with
+        `asyncio.gather`, the connection pool doesn't keep the send order and a request with a higher nonce reaching
+        the exchange first gets the rest rejected.
+
+        Args:
+            requests: A list of (path, params) pairs, the same arguments as passed to `get`.
+        """
+        return self.auth.headers_many([self._get_url(path, params).encode() for path, params in requests])
+
+    @private
+    def batch_post_headers(self, requests: List[Tuple[str, dict]]) -> List[dict]:
+        """Creates auth headers for many POST requests at once.
+
+        Pass each of the headers to `post` with the same path and data it was created for. Nonces are assigned
+        when the batch is signed, so as with `batch_get_headers` the requests must be sent sequentially, in the given
+        order and before signing any other request, not fanned out with `asyncio.gather`.
+
+        Args:
+            requests: A list of (path, data) pairs, the same arguments as passed to `post`.
+        """
+        return self.auth.headers_many([''.join(self._post_request(path, data)).encode() for path, data in requests])
+
+    async def get(
+        self,
+        path: str,
+        params: Union[Dict, str] = '',
+        headers: Optional[dict] = None,
+        signed: bool = True
+    ):
+        """The basic GET query, inserts authorization header.
+
+        Args:
+            path: Endpoint path.
+            params: Query parameters, a dict or an already url encoded query string.
+            headers: Auth headers precomputed with `batch_get_headers` (Optional), batched requests must be sent sequentially.
+            signed: Set to False for public endpoints to skip signing the request.
+        """
+        url = self._get_url(path, params)
+        if headers is None:
+            headers = self.auth.headers_bytes(url.encode()) if signed and self.auth else {}
+        async with self.session.get(url, headers=headers, timeout=self.rest_timeout) as resp:
             if resp.content_type=='application/json':
-                response = await resp.json()
+                response = json_loads(await resp.read())
             else:
                 print(await resp.text())
                 raise ValueError(f"Endpoint should be returning json, got {resp.content_type} instead.")
             return response
 
-    async def post(self, path: str, data: dict):
-        """The basic POST query, inserts authorization header"""
-        data_str = json.dumps(data,separators=(',',':'))
-        async with self.session.post(
-            self.endpoint+path,
-            data=data_str,
-            headers = self.auth.headers(self.endpoint+path+data_str)
-        ) as resp:
+    async def post(self, path: str, data: dict, headers: Optional[dict] = None):
+        """The basic POST query, inserts authorization header
+
+        Args:
+            path: Endpoint path.
+            data: Request body.
+            headers: Auth headers precomputed with `batch_post_headers` (Optional), batched requests must be sent sequentially.
+        """
+        url, data_str = self._post_request(path, data)
+        if headers is None:
+            headers = self.auth.headers_bytes((url+data_str).encode())
+        async with self.session.post(url, data=data_str, headers=headers, timeout=self.rest_timeout) as resp:
             if resp.content_type=='application/json':
-                response = await resp.json()
+                response = json_loads(await resp.read())
             else:
                 print(await resp.text())
                 raise ValueError(f"Endpoint should be returning json, got {resp.content_type} instead.")
@@ -180,71 +496,86 @@ class XeggeXClient():
     async def ws_get(self, ws: ClientWebSocketResponse, message: dict):
         """Sends and receives the websocket response or throws a WSException if an error happened."""
         message['id'] = next(self.id)
-        self.sending_event.set()
-        async with self.ws_lock:
-            await ws.send_str(json.dumps(message))
-        q, e = self.ws_responses[message['id']], self.ws_responses['error']
-        done, pending = await asyncio.wait([
-            asyncio.create_task(q.get()),
-            asyncio.create_task(e.get()),
-            ws.listener_task
-        ], return_when=asyncio.FIRST_COMPLETED)
-        d = done.pop()
+        return await self._ws_request(ws, message['id'], json_dumps(message))
+
+    async def ws_get_static(self, ws: ClientWebSocketResponse, method: str):
+        """Same as `ws_get` for the parameterless methods in `_STATIC_FRAMES`, skips building and serializing the message."""
+        message_id = next(self.id)
+        return await self._ws_request(ws, message_id, self._STATIC_FRAMES[method]+str(message_id)+'}')
+
+    async def _ws_request(self, ws: ClientWebSocketResponse, message_id: int, frame: str):
+        """Sends a serialized frame and waits for the response with a matching id."""
+        response = asyncio.get_running_loop().create_future()
+        self._pending[message_id] = response
+        ws.send_queue.put_nowait(frame)
+        error = asyncio.create_task(self.ws_responses['error'].get())
+        try:
+            done, pending = await asyncio.wait([
+                response,
+                error,
+                ws.listener_task,
+                ws.writer_task
+            ], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self._pending.pop(message_id, None)
+            error.cancel()
+        d = response if response in done else done.pop()
         if d.exception() is not None:
             raise d.exception()
-        if 'error' in d.result().keys():
+        if 'error' in d.result():
             raise WSException(d.result()['error'])
         else:
-            self.ws_responses.pop(message['id'])
             return d.result()
 
     async def _ws_listener(self, ws: ClientWebSocketResponse) -> None:
         """A coroutine that listens on the websocket and dispatches the received messages to the queue.
         """
+        # aiohttp allows sending while a receive is pending, so the frames are read directly,
+        # without any per frame tasks, and the writer task doesn't need to interrupt the listener.
+        receive, parse = ws.receive, self._ws_parse_msg
         while True:
-            msg = None
-            while not msg:
-                async with self.ws_lock:
-                    msg_task = asyncio.create_task(ws.receive())
-                    done, pending = await asyncio.wait(
-                        [msg_task, asyncio.create_task(self.sending_event.wait())],
-                        return_when = asyncio.FIRST_COMPLETED
-                    )
-                    if msg_task in pending:
-                        self.sending_event.clear()
-                        msg_task.cancel()
-                    else:
-                        msg = msg_task.result()
-                await asyncio.sleep(0)
-            result = self._ws_parse_msg(ws, msg)
-            if not result:
+            if not parse(ws, await receive()):
                 raise WSException()
 
+    async def _ws_writer(self, ws: ClientWebSocketResponse) -> None:
+        """A coroutine that sends the queued frames.
 
+        It is the only coroutine writing to the websocket, so senders just enqueue their frame and sends never interleave.
+        Each frame is still written to the transport on its own.
+        """
+        q = ws.send_queue
+        while True:
+            await ws.send_str(await q.get())
 
     def _ws_parse_msg(self, ws, msg) -> bool:
         """Determines the type of ws message message and acts accor"""
-        if msg.type == aiohttp.WSMsgType.TEXT:
-            message = msg.json()
-            if 'method' in message.keys():
-                for stream, values in subscriptions.items():
-                    if message['method'] in values['methods']:
-                        self.ws_responses[stream].put_nowait(message)
-                        return True
-            if 'error' in message.keys():
+        msg_type = msg.type
+        # Binary frames are handed to the json parser as bytes, skipping the str decode and its utf-8 validation.
+        if msg_type == WS_TEXT or msg_type == WS_BINARY:
+            message = json_loads(msg.data)
+            stream = METHOD_TO_STREAM.get(message.get('method'))
+            if stream is not None:
+                self.ws_responses[stream].put_nowait(message)
+                return True
+            response = self._pending.pop(message.get('id'), None)
+            if response is not None:
+                if not response.done():
+                    response.set_result(message)
+                return True
+            if 'error' in message:
                 self.ws_responses['error'].put_nowait(message)
                 print(message)
                 return True
-            if 'id' in message.keys():
-                self.ws_responses[message['id']].put_nowait(message)
+            if 'id' in message:
+                # A late response to a request nobody waits for anymore.
                 return True
-        elif msg.type == aiohttp.WSMsgType.ERROR:
+        elif msg_type == WS_ERROR:
             print(f"websocket connection closed with error {ws.exception()}")
             return False
-        elif msg.type == aiohttp.WSMsgType.CLOSED:
+        elif msg_type == WS_CLOSED:
             print(f"websocket connection closed.")
             raise WSConnectionClosed()
-        elif msg.type == aiohttp.WSMsgType.CLOSE:
+        elif msg_type == WS_CLOSE:
             print(f"websocket connection close msg.")
             raise WSConnectionClosed()
         else:
@@ -252,40 +583,103 @@ class XeggeXClient():
 
     def websocket_context(self) -> WSListenerContext:
         """Gets an entry point to a websocket, to be used with `async with ... as ws:`."""
-        ws = self.session.ws_connect(self.ws_endpoint)
-        return WSListenerContext(ws, self._ws_listener)
-
-    async def ws_stream_generator(self, ws: ClientWebSocketResponse, stream, **params) -> Generator:
+        # permessage-deflate shrinks the repetitive JSON of the market feeds, unlimited size for large orderbook snapshots.
+        ws = self.session.ws_connect(
+            self.ws_endpoint,
+            compress=15,
+            max_msg_size=0,
+            receive_timeout=None,
+            heartbeat=30
+        )
+        return WSListenerContext(ws, self._ws_listener, self._ws_writer)
+
+    def ws_stream_generator(
+        self,
+        ws: ClientWebSocketResponse,
+        stream: str,
+        response_methods: Optional[FrozenSet[str]] = None,
+        **params
+    ) -> Generator:
         """Creates a stream subscribtion in a form of a generator.
 
         The generator is meant to be iterated over with `async for` or `anext` builtin.
 
         Args:
             ws: Websocket response object.
-            message: Stream subsctiption message.
-            response_methods: The list of \"method\" keys returned from as the stream response.
-                Allows you to drop some parts of the communication, like the initial snapshot.
+            stream: Stream name, one of the `subscriptions` keys.
+            response_methods: The set of \"method\" keys of the stream to yield, all of them if not given.
+                Allows you to drop some parts of the communication, like the initial snapshot, for example
+                `frozenset({'updateOrderbook'})`.
+            params: Stream subscription parameters.
         """
-        message = subscriptions[stream]['message'](**params)
+        return self._ws_stream(ws, stream, subscription_frame(stream, **params), response_methods)
 
-        self.sending_event.set()
-        async with self.ws_lock:
-            await ws.send_str(json.dumps(message))
+    def subscribe_many(
+        self,
+        ws: ClientWebSocketResponse,
+        subs: List[Tuple[str, Dict[str, Any], Optional[FrozenSet[str]]]]
+    ) -> Dict[str, Generator]:
+        """Subscribes to multiple streams at once.
 
+        All the subscription frames are queued right away, instead of on the first iteration of each generator.
+        Messages are buffered per stream name, so a single generator is returned for every distinct stream and it yields
+        the messages of all the subscriptions to that stream, for example the trades of every subscribed symbol.
+        Tell them apart by `message['params']['symbol']`. The generators can be combined with `combine_streams`.
+
+        Args:
+            ws: Websocket response object.
+            subs: A list of (stream, params, response_methods) tuples, `response_methods` works as in `ws_stream_generator`,
+                for example `[('trades', {'symbol': 'XRG/USDT'}, None), ('orderbook', {'symbol': 'XRG/USDT', 'limit': 20}, frozenset({'updateOrderbook'}))]`.
+                The methods of subscriptions to the same stream are joined, None for any of them yields all of them.
+        """
+        methods: Dict[str, Optional[FrozenSet[str]]] = {}
+        for stream, params, response_methods in subs:
+            ws.send_queue.put_nowait(subscription_frame(stream, **params))
+            if stream not in methods:
+                methods[stream] = response_methods
+            elif methods[stream] is not None:
+                methods[stream] = None if response_methods is None else methods[stream] | response_methods
+        return {stream: self._ws_stream(ws, stream, response_methods=m) for stream, m in methods.items()}
+
+    async def _ws_stream(
+        self,
+        ws: ClientWebSocketResponse,
+        stream: str,
+        frame: Optional[str] = None,
+        response_methods: Optional[FrozenSet[str]] = None
+    ) -> Generator:
+        """Yields the messages of a stream, sending the subscription frame first if it's given."""
+        if frame is not None:
+            ws.send_queue.put_nowait(frame)
+
+        q, e = self.ws_responses[stream], self.ws_responses['error']
         while True:
-            q, e = self.ws_responses[stream], self.ws_responses['error']
-            done, pending = await asyncio.wait([
-                asyncio.create_task(q.get()),
-                asyncio.create_task(e.get()),
-                ws.listener_task
-            ], return_when=asyncio.FIRST_COMPLETED)
-            d = done.pop()
+            if q:
+                # Drain what's already buffered without a round trip through the event loop.
+                result = q.popleft()
+                if response_methods is None or result['method'] in response_methods:
+                    yield result
+                continue
+            message = asyncio.create_task(q.get())
+            error = asyncio.create_task(e.get())
+            try:
+                done, pending = await asyncio.wait([
+                    message,
+                    error,
+                    ws.listener_task,
+                    ws.writer_task
+                ], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                message.cancel()
+                error.cancel()
+            d = message if message in done else done.pop()
             if d.exception() is not None:
                 raise d.exception()
-            if 'error' in d.result().keys():
-                raise WSException(d.result()['error'])
-            else:
-                yield d.result()
+            result = d.result()
+            if 'error' in result:
+                raise WSException(result['error'])
+            if response_methods is None or result['method'] in response_methods:
+                yield result
 
     async def combine_streams(self, stream_list: List):
         '''Lets you iterate over multiple streams at once as the messages come.
@@ -312,8 +706,8 @@ class XeggeXClient():
         Args:
             ws: Websocket response object.
         """
-        login = self.auth.ws_auth_message()
-        return await self.ws_get(ws, login)
+        message_id = next(self.id)
+        return await self._ws_request(ws, message_id, self.auth.ws_auth_frame(message_id))
 
     @private
     async def ws_create_order(
@@ -341,7 +735,7 @@ class XeggeXClient():
         """
         message = {
             'method': 'newOrder',
-            'params': {
+            'params': pop_none({
                 'symbol':symbol,
                 'side': side,
                 'quantity': quantity,
@@ -349,9 +743,8 @@ class XeggeXClient():
                 'type': order_type,
                 'userProvidedId': user_provided_id,
                 'strictValidate': strict_validate
-            }
+            })
         }
-        pop_none(message['params'])
         return await self.ws_get(ws, message)
 
     @private
@@ -368,11 +761,10 @@ class XeggeXClient():
             order_id: Exchange internal order ID.
             user_provided_id: Optional user-defined ID.
         """
-        message = {'method': 'cancelOrder',
-                   'params': {'orderId': order_id, 'userProvidedId': user_provided_id}}
         error_msg = "You have to unambiguously specify order ID to cancel it"
-        assert (order_id is not None) ^ (user_provided_id is not None), error_msg 
-        pop_none(message['params'])
+        assert (order_id is not None) ^ (user_provided_id is not None), error_msg
+        message = {'method': 'cancelOrder',
+                   'params': pop_none({'orderId': order_id, 'userProvidedId': user_provided_id})}
         return await self.ws_get(ws, message)
 
     @private
@@ -383,8 +775,7 @@ class XeggeXClient():
             ws: Websocket response object.
             symbol: Market symbol, two tickers joined with a \"/\". For example \"XRG/LTC\".
         """
-        message = {'method': 'getOrders', 'params': {'symbol': symbol}}
-        pop_none(message['params'])
+        message = {'method': 'getOrders', 'params': pop_none({'symbol': symbol})}
         return await self.ws_get(ws, message)
 
     @private
@@ -394,8 +785,7 @@ class XeggeXClient():
         Args:
             ws: Websocket response object.
         """
-        message = {'method':'getTradingBalance', 'params':{}}
-        return await self.ws_get(ws, message)
+        return await self.ws_get_static(ws, 'getTradingBalance')
 
     async def ws_get_assets_list(self, ws: ClientWebSocketResponse):
         """Get assets list through a websocket.
@@ -403,8 +793,7 @@ class XeggeXClient():
         Args:
             ws: Websocket response object.
         """
-        message = {'method':'getAssets', 'params':{}}
-        return await self.ws_get(ws, message)
+        return await self.ws_get_static(ws, 'getAssets')
 
     async def ws_get_asset(self, ws: ClientWebSocketResponse, ticker: str):
         """Get asset trhough a websocket.
@@ -422,8 +811,7 @@ class XeggeXClient():
         Args:
             ws: Websocket response object.
         """
-        message = {'method':'getMarkets', 'params':{}}
-        return await self.ws_get(ws, message)
+        return await self.ws_get_static(ws, 'getMarkets')
 
     async def ws_get_market(self, ws: ClientWebSocketResponse, symbol: str):
         """Get market info through a websocket.
@@ -460,20 +848,20 @@ class XeggeXClient():
 
         """
         if isinstance(history_from, datetime):
-            history_from = history_from.strftime("%Y-%m-%dT%H:%M:%SZ")
-            history_till = history_till.strftime("%Y-%m-%dT%H:%M:%SZ")
+            history_from = history_from.replace(tzinfo=None).isoformat(timespec='seconds')+'Z'
+        if isinstance(history_till, datetime):
+            history_till = history_till.replace(tzinfo=None).isoformat(timespec='seconds')+'Z'
         message = {
             'method': 'getTrades',
-            'params': {
+            'params': pop_none({
                 'symbol': symbol,
                 'limit': limit,
                 'offset': offset,
                 'sort': sort,
                 'from': history_from,
                 'till': history_till
-            }
+            })
         }
-        pop_none(message['params'])
         return await self.ws_get(ws, message)
 
 # Public streams
@@ -572,14 +960,13 @@ class XeggeXClient():
 
 # Private streams
 
+    @private
     def ws_subscribe_reports_generator(self, ws: ClientWebSocketResponse):
         """Creates a reports stream subscribtion in a form of a generator.
 
         Args:
             ws: Websocket response object.
         """
-        #async generators are weird to handle with decorators, manually checking for auth.
-        assert self.auth, "Auth not found. You can't use Account endpoints without specifying API keys. Specify \"access_key\" and \"secret_key\" in \"xeggex_settings.json\" file."
         return self.ws_stream_generator(ws, "reports")
 
     @private
@@ -589,15 +976,15 @@ class XeggeXClient():
         Args:
             ws: Websocket response object.
         """
-        message = {'method': 'subscribeReports', 'params': {}}
-        return await self.ws_get(ws, message)
+        return await self.ws_get_static(ws, 'unsubscribeReports')
 
 # Public methods
 
+    @cached
     async def get_assets(self):
-        """Get a list of assets."""
+        """Get a list of assets. Reused for `cache_ttl` seconds when caching is enabled."""
         path = '/asset/getlist'
-        return await self.get(path)
+        return await self.get(path, signed=False)
 
     async def get_asset_by_id(self, asset_id: str):
         """Get asset by id.
@@ -606,7 +993,7 @@ class XeggeXClient():
             asset_id: Exchange internal asset ID.
         """
         path = f'/asset/getbyid/{asset_id}'
-        return await self.get(path)
+        return await self.get(path, signed=False)
 
     async def get_asset_by_ticker(self, ticker: str):
         """Get asset by ticker.
@@ -615,35 +1002,39 @@ class XeggeXClient():
             ticker: Currency symbol, for example \"XRG\".
         """
         path = f'/asset/getbyticker/{ticker}'
-        return await self.get(path)
+        return await self.get(path, signed=False)
 
+    @cached
     async def get_markets(self):
-        """Get list of markets"""
+        """Get list of markets. With caching enabled the prices can be up to `cache_ttl` seconds old."""
         path = '/market/getlist'
-        return await self.get(path)
+        return await self.get(path, signed=False)
 
+    @cached
     async def get_market_by_id(self, market_id: str):
-        """Get market by market id.
+        """Get market by market id. With caching enabled the prices can be up to `cache_ttl` seconds old.
 
         Args:
             market_id: Exchange internal market ID.
         """
         path = f'/market/getbyid/{market_id}'
-        return await self.get(path)
+        return await self.get(path, signed=False)
 
+    @cached
     async def get_market_by_symbol(self, symbol: str):
-        """Get market by symbol.
+        """Get market by symbol. With caching enabled the prices can be up to `cache_ttl` seconds old.
 
         Args:
             symbol: Market symbol, two tickers joined with a \"_\". For example \"XRG_LTC\".
         """
         path = f'/market/getbysymbol/{symbol}'
-        return await self.get(path)
+        return await self.get(path, signed=False)
 
+    @cached
     async def get_pools(self):
-        """Get list of liquidity pools"""
+        """Get list of liquidity pools. With caching enabled the prices can be up to `cache_ttl` seconds old."""
         path = '/pool/getlist'
-        return await self.get(path)
+        return await self.get(path, signed=False)
 
     async def get_pool_by_id(self, pool_id: str):
         """Get pool by pool id.
@@ -652,7 +1043,7 @@ class XeggeXClient():
             pool_id: Exchange internal market ID.
         """
         path = f'/pool/getbyid/{pool_id}'
-        return await self.get(path)
+        return await self.get(path, signed=False)
 
     async def get_pool_by_symbol(self, pool_symbol: str):
         """Get pool by symbol.
@@ -661,7 +1052,7 @@ class XeggeXClient():
             symbol: Market symbol, two tickers joined with a \"_\". For example \"XRG_LTC\".
         """
         path = f'/pool/getbysymbol/{pool_symbol}'
-        return await self.get(path)
+        return await self.get(path, signed=False)
 
     async def get_orderbook_by_symbol(self, symbol: str):
         """Get market orderbook by symbol.
@@ -670,7 +1061,7 @@ class XeggeXClient():
             symbol: Market symbol, two tickers joined with a \"_\". For example \"XRG_LTC\".
         """
         path = f'/market/getorderbookbysymbol/{symbol}'
-        return await self.get(path)
+        return await self.get(path, signed=False)
 
     async def get_orderbook_by_market_id(self, market_id: str):
         """Get market orderbook by market id.
@@ -679,7 +1070,7 @@ class XeggeXClient():
             market_id: Exchange internal market ID.
         """
         path = f'/market/getorderbookbymarketid/{market_id}'
-        return await self.get(path)
+        return await self.get(path, signed=False)
 
 # Private methods
 
@@ -695,9 +1086,26 @@ class XeggeXClient():
         bal = await self.get_balances()
         return [
             b for b in bal
-            if Decimal(b['available'])!=0 or Decimal(b['pending'])!=0 or Decimal(b['held'])!=0
+            if nonzero(b['available']) or nonzero(b['pending']) or nonzero(b['held'])
         ]
 
+    @private
+    async def get_nonzero_with_deposits(self, concurrency: int = 64):
+        """Get nonzero account balances together with their deposit addresses.
+
+        The deposit addresses are requested concurrently. Returns a list of (balance, deposit address) pairs.
+
+        Args:
+            concurrency: Maximum number of deposit address requests in flight.
+        """
+        balances = await self.get_nonzero_balances()
+        semaphore = asyncio.Semaphore(concurrency)
+        async def deposit_address(ticker):
+            async with semaphore:
+                return await self.get_deposit_address(ticker)
+        addresses = await asyncio.gather(*(deposit_address(b['asset']) for b in balances))
+        return list(zip(balances, addresses))
+
     @private
     async def get_deposit_address(self, ticker: str):
         """Get your deposit address.
@@ -732,7 +1140,9 @@ class XeggeXClient():
         """
 
         path = '/createorder'
-        params =  {
+        if order_type in [None, 'limit']:
+            assert price is not None, "Specify price for a limit order"
+        params = pop_none({
             'userProvidedId': user_provided_id,
             'symbol': symbol,
             'side': side,
@@ -740,10 +1150,7 @@ class XeggeXClient():
             'quantity': quantity,
             'price': price,
             'strictValidate': strict_validate,
-        }
-        if order_type in [None, 'limit']:
-            assert price is not None, "Specify price for a limit order"
-        pop_none(params)
+        })
         return await self.post(path, params)
 
     @private
@@ -789,13 +1196,12 @@ class XeggeXClient():
             paymentid: If required, provide payment id.
         """
         path = '/createwithdrawal'
-        data = {
+        data = pop_none({
             "ticker": ticker,
             "quantity": quantity,
             "address": address,
             "paymentId": payment_id
-        }
-        pop_none(data)
+        })
         return await self.post(path, data)
 
     @private
@@ -808,9 +1214,8 @@ class XeggeXClient():
             skip: Skip this many records.
         """
         path = '/getdeposits'
-        params = { 'ticker': ticker, 'limit': limit, 'skip':skip }
-        pop_none(params)
-        return await self.get(path, params)
+        query = query_string((('ticker', ticker), ('limit', limit), ('skip', skip)))
+        return await self.get(path, query)
 
     @private
     async def get_withdrawals(self, limit: int, skip: int, ticker: Optional[str] = None):
@@ -822,9 +1227,8 @@ class XeggeXClient():
             skip: Skip this many records.
         """
         path = '/getwithdrawals'
-        params = { 'ticker': ticker, 'limit': limit, 'skip':skip }
-        pop_none(params)
-        return await self.get(path, params)
+        query = query_string((('ticker', ticker), ('limit', limit), ('skip', skip)))
+        return await self.get(path, query)
 
     @private
     async def get_order(self, order_id: str):
@@ -853,14 +1257,8 @@ class XeggeXClient():
             symbol: Market symbol, two tickers joined with a \"_\". For example \"XRG_LTC\".
         """
         path = '/getorders'
-        params = {
-            'symbol': symbol,
-            'status':status,
-            'limit': limit,
-            'skip': skip
-        }
-        pop_none(params)
-        return await self.get(path, params)
+        query = query_string((('symbol', symbol), ('status', status), ('limit', limit), ('skip', skip)))
+        return await self.get(path, query)
 
     @private
     async def get_trades(self, limit: int, skip: int, symbol: Optional[str] = None):
@@ -874,9 +1272,8 @@ class XeggeXClient():
             symbol: Market symbol, two tickers joined with a \"_\". For example \"XRG_LTC\".
         """
         path = '/gettrades'
-        params = {'limit':limit, 'skip':skip, 'symbol':symbol}
-        pop_none(params)
-        return await self.get(path, params)
+        query = query_string(zip(self._PAGE_KEYS, (limit, skip, symbol)))
+        return await self.get(path, query)
 
     @private
     async def get_trades_since(
@@ -896,11 +1293,9 @@ class XeggeXClient():
             skip: Skip this many records.
             symbol: Market symbol, two tickers joined with a \"_\". For example \"XRG_LTC\".
         """
-
         path = '/gettradessince'
-        params = {'since':since, 'limit':limit, 'skip':skip, 'symbol':symbol}
-        pop_none(params)
-        return await self.get(path, params)
+        query = query_string(zip(self._SINCE_KEYS, (since, limit, skip, symbol)))
+        return await self.get(path, query)
 
     @private
     async def get_pool_trades(self, limit: int, skip: int, symbol: Optional[str] = None):
@@ -913,11 +1308,9 @@ class XeggeXClient():
             skip: Skip this many records.
             symbol: Market symbol, two tickers joined with a \"_\". For example \"XRG_LTC\".
         """
-
         path = '/getpooltrades'
-        params = {'limit':limit, 'skip':skip, 'symbol':symbol}
-        pop_none(params)
-        return await self.get(path, params)
+        query = query_string(zip(self._PAGE_KEYS, (limit, skip, symbol)))
+        return await self.get(path, query)
 
     @private
     async def get_pool_trades_since(
@@ -937,10 +1330,7 @@ class XeggeXClient():
             skip: Skip this many records.
             symbol: Market symbol, two tickers joined with a \"_\". For example \"XRG_LTC\".
         """
-
-
         path = '/getpooltradessince'
-        params = {'since':since, 'limit':limit, 'skip':skip, 'symbol':symbol}
-        pop_none(params)
-        return await self.get(path, params)
+        query = query_string(zip(self._SINCE_KEYS, (since, limit, skip, symbol)))
+        return await self.get(path, query)
 